@@ -12,51 +12,332 @@ Setup:
   3. Include taskWebhookUrl: {base}/task in your kickoff payload
 """
 
+import atexit
+import copy
+import hashlib
 import json
+import logging
+import mmap
+import multiprocessing
 import os
-import re
 import threading
+import time
+from contextlib import contextmanager
 from pathlib import Path
 
-_HITL_STORE = Path(os.getenv("HITL_STORE_PATH", "./pending_hitl_approvals.json"))
-_SERVER_THREAD: threading.Thread | None = None
+try:
+    import fcntl
+except ImportError:  # Windows: lock with msvcrt instead
+    fcntl = None
+    import msvcrt
 
-# Task names that indicate a review step (Support flow: request_review)
-_REVIEW_TASK_PATTERN = re.compile(r"review", re.IGNORECASE)
+try:
+    import orjson
 
+    _loads = orjson.loads
 
-def _read_store() -> list[dict]:
-    """Thread-safe read of pending approvals."""
+    def _dumps(obj, indent: bool = False) -> bytes:
+        return orjson.dumps(obj, option=orjson.OPT_INDENT_2 if indent else 0)
+
+except ImportError:  # orjson is optional; fall back to stdlib json
+    _loads = json.loads
+
+    def _dumps(obj, indent: bool = False) -> bytes:
+        if indent:
+            return json.dumps(obj, indent=2).encode("utf-8")
+        return json.dumps(obj, separators=(",", ":")).encode("utf-8")
+
+logger = logging.getLogger(__name__)
+
+
+def _resolve_store_dir() -> Path:
+    """Directory for the sharded store: HITL_STORE_DIR, else derived from the legacy HITL_STORE_PATH."""
+    store_dir = os.getenv("HITL_STORE_DIR")
+    if store_dir:
+        return Path(store_dir)
+    legacy = os.getenv("HITL_STORE_PATH")
+    if legacy:
+        path = Path(legacy)
+        # /data/pending.json -> /data/pending/ ; a suffix-less path may still be the old file
+        if path.suffix in (".json", ".jsonl"):
+            return path.with_suffix("")
+        return path.with_name(path.name + ".d")
+    return Path("./pending_hitl_approvals")
+
+
+# Pending approvals are sharded into up to 256 append-only logs, <xx>.jsonl, by execution_id
+_HITL_DIR = _resolve_store_dir()
+# Single-file stores written by earlier versions are imported once per process
+_LEGACY_CHECKED = False
+_LEGACY_LOCK = threading.Lock()
+_SHARD_LOCKS = {f"{i:02x}": threading.Lock() for i in range(256)}
+# Indent structured task output shown in the approval UI (off by default)
+_PRETTY_CONTENT = os.getenv("HITL_PRETTY") == "1"
+# Webhook server child. spawn (not fork) on every platform: the child starts from a
+# fresh interpreter, so it inherits no parent threads, locks or unrelated fds.
+_MP_CONTEXT = multiprocessing.get_context("spawn")
+_SERVER_PROCESS: multiprocessing.process.BaseProcess | None = None
+_SERVER_STARTUP_TIMEOUT = 30.0
+
+# Compact a shard once more than this fraction of its lines are dead
+# (tombstones, removed approvals, or approvals superseded by a later upsert)
+_COMPACT_DEAD_RATIO = 0.5
+
+# Constant webhook response bodies, serialized once
+_OK = b'{"ok":true}'
+_HEALTH = b'{"status":"ok"}'
+_NOT_REVIEW = b'{"ok":true,"message":"Task received (not a review task, ignored)"}'
+_STORED = b'{"ok":true,"message":"Review task stored for approval"}'
+_INVALID_JSON = b'{"ok":false,"message":"Invalid JSON body"}'
+_MISSING_KICKOFF = b'{"ok":false,"message":"Missing kickoff_id"}'
+
+# Per-process cache of each replayed shard: path -> (stat signature, approvals)
+_CACHE_LOCK = threading.Lock()
+_CACHE: dict[Path, tuple[tuple[int, int, int], dict]] = {}
+
+
+def _shard_path(execution_id: str) -> Path:
+    """Return the log shard holding approvals for execution_id."""
+    digest = hashlib.blake2s(str(execution_id).encode("utf-8"), digest_size=1).hexdigest()
+    return _HITL_DIR / f"{digest}.jsonl"
+
+
+@contextmanager
+def _flock(lock_path: Path):
+    """Hold an exclusive cross-process lock on lock_path (flock, or msvcrt.locking on Windows)."""
+    lock_path.parent.mkdir(parents=True, exist_ok=True)
+    fd = os.open(lock_path, os.O_RDWR | os.O_CREAT, 0o644)
+    try:
+        if fcntl is not None:
+            fcntl.flock(fd, fcntl.LOCK_EX)
+        else:
+            # Lock byte 0; LK_LOCK gives up after ~10s, so keep retrying until we own it
+            os.lseek(fd, 0, os.SEEK_SET)
+            while True:
+                try:
+                    msvcrt.locking(fd, msvcrt.LK_LOCK, 1)
+                    break
+                except OSError:
+                    continue
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(fd, fcntl.LOCK_UN)
+            else:
+                os.lseek(fd, 0, os.SEEK_SET)
+                msvcrt.locking(fd, msvcrt.LK_UNLCK, 1)
+    finally:
+        os.close(fd)
+
+
+@contextmanager
+def _store_lock(shard: Path):
+    """Serialize mutations of one shard across threads and processes (flock on a side file)."""
+    with _SHARD_LOCKS[shard.stem]:
+        with _flock(shard.with_suffix(".lock")):
+            yield
+
+
+def _scan_log(shard: Path) -> tuple[dict[tuple[str, str], dict], int, int]:
+    """mmap an append-only shard and replay it.
+
+    Returns (live approvals keyed by (execution_id, task_id), record lines, tombstone lines).
+    """
+    live: dict[tuple[str, str], dict] = {}
+    records = tombstones = 0
+    try:
+        fd = os.open(shard, os.O_RDONLY)
+    except OSError:
+        return live, records, tombstones
     try:
-        if _HITL_STORE.exists():
-            with open(_HITL_STORE, "r") as f:
-                return json.load(f)
-    except (json.JSONDecodeError, OSError):
+        if os.fstat(fd).st_size == 0:
+            return live, records, tombstones
+        with mmap.mmap(fd, 0, access=mmap.ACCESS_READ) as mm:
+            for line in iter(mm.readline, b""):
+                try:
+                    entry = _loads(line)
+                except ValueError:
+                    # Torn or corrupt line; skip it rather than dropping the whole store
+                    continue
+                if not isinstance(entry, dict):
+                    continue
+                key = (entry.get("execution_id"), entry.get("task_id"))
+                live.pop(key, None)
+                if entry.get("deleted"):
+                    tombstones += 1
+                else:
+                    records += 1
+                    live[key] = entry
+    except (OSError, ValueError):
         pass
-    return []
+    finally:
+        os.close(fd)
+    return live, records, tombstones
+
+
+def _invalidate_cache(shard: Path) -> None:
+    with _CACHE_LOCK:
+        _CACHE.pop(shard, None)
 
 
-def _write_store(data: list[dict]) -> None:
-    """Thread-safe write of pending approvals."""
-    with open(_HITL_STORE, "w") as f:
-        json.dump(data, f, indent=2)
+def _read_shard(shard: Path) -> dict[tuple[str, str], dict]:
+    """Read one shard, replaying it only if it changed since the last read."""
+    try:
+        st = shard.stat()
+    except OSError:
+        return {}
+    # Size and inode catch appends/compactions that land within one mtime tick
+    signature = (st.st_mtime_ns, st.st_size, st.st_ino)
+    with _CACHE_LOCK:
+        cached = _CACHE.get(shard)
+        if cached is not None and cached[0] == signature:
+            return cached[1]
+    live, _, _ = _scan_log(shard)
+    with _CACHE_LOCK:
+        _CACHE[shard] = (signature, live)
+    return live
+
+
+def _read_store() -> dict[tuple[str, str], dict]:
+    """Read pending approvals from every shard, keyed by (execution_id, task_id)."""
+    _migrate_legacy_store()
+    store: dict[tuple[str, str], dict] = {}
+    try:
+        shards = sorted(_HITL_DIR.glob("*.jsonl"))
+    except OSError:
+        return store
+    for shard in shards:
+        store.update(_read_shard(shard))
+    return store
+
+
+def _append_to_log(shard: Path, buf: bytes) -> None:
+    """Append buf to a shard with a single O_APPEND write(). Hold _store_lock(shard).
+
+    The fd is not kept open between appends, so compaction (possibly in another
+    process) can always replace the shard, including on Windows.
+    """
+    fd = os.open(shard, os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o644)
+    try:
+        os.write(fd, buf)
+    finally:
+        os.close(fd)
+
+
+def _write_store(shard: Path, record: dict) -> None:
+    """Append a single record (approval or tombstone) to a shard. Hold _store_lock(shard)."""
+    _append_to_log(shard, _dumps(record) + b"\n")
+    _invalidate_cache(shard)
+
+
+def _write_store_bytes(shard: Path, buf: bytes) -> None:
+    """Replace a shard with buf: one synchronous write to a temp file, then an atomic rename."""
+    tmp = str(shard) + ".tmp"
+    # O_DSYNC makes the write durable without a separate fsync() (not available on Windows)
+    flags = os.O_WRONLY | os.O_CREAT | os.O_TRUNC | getattr(os, "O_DSYNC", 0)
+    fd = os.open(tmp, flags, 0o644)
+    try:
+        view = memoryview(buf)
+        while view:
+            view = view[os.write(fd, view):]
+    finally:
+        os.close(fd)
+    os.replace(tmp, shard)
+
+
+def _compact_store(shard: Path) -> None:
+    """Rewrite a shard with only live approvals if dead lines dominate it. Hold _store_lock(shard)."""
+    live, records, tombstones = _scan_log(shard)
+    total = records + tombstones
+    dead = total - len(live)
+    if not total or dead / total <= _COMPACT_DEAD_RATIO:
+        return
+    _write_store_bytes(shard, b"".join(_dumps(entry) + b"\n" for entry in live.values()))
+    _invalidate_cache(shard)
+
+
+def _legacy_store_paths() -> list[Path]:
+    paths = [
+        _HITL_DIR.with_name(_HITL_DIR.name + ".json"),
+        _HITL_DIR.with_name(_HITL_DIR.name + ".jsonl"),
+    ]
+    if os.getenv("HITL_STORE_PATH"):
+        paths.append(Path(os.environ["HITL_STORE_PATH"]))
+    return list(dict.fromkeys(paths))
+
+
+def _load_legacy_store(path: Path) -> list[dict]:
+    """Approvals from a single-file store: a JSON list, or the earlier append-only log."""
+    try:
+        data = _loads(path.read_bytes())
+    except ValueError:
+        return list(_scan_log(path)[0].values())
+    if isinstance(data, dict):
+        data = [data]
+    return [a for a in data if isinstance(a, dict)] if isinstance(data, list) else []
+
+
+def _migrate_legacy_store() -> None:
+    """Import single-file stores from earlier versions into the shards, then rename them *.migrated."""
+    global _LEGACY_CHECKED
+    if _LEGACY_CHECKED:
+        return
+    with _LEGACY_LOCK:
+        if _LEGACY_CHECKED:
+            return
+        legacy = [p for p in _legacy_store_paths() if p.is_file()]
+        if legacy:
+            with _flock(_HITL_DIR / "migrate.lock"):
+                for path in legacy:
+                    # Another process may have migrated it while we waited for the lock
+                    if not path.is_file():
+                        continue
+                    approvals = _load_legacy_store(path)
+                    base_ns = time.time_ns()
+                    for i, approval in enumerate(approvals):
+                        approval = dict(approval, execution_id=str(approval.get("execution_id")))
+                        approval.setdefault("received_at_ns", base_ns + i)
+                        shard = _shard_path(approval["execution_id"])
+                        with _store_lock(shard):
+                            _write_store(shard, approval)
+                    migrated = path.with_name(path.name + ".migrated")
+                    os.replace(path, migrated)
+                    logger.warning(
+                        "Migrated %d pending approvals from legacy store %s into %s (original kept as %s)",
+                        len(approvals),
+                        path,
+                        _HITL_DIR,
+                        migrated,
+                    )
+        _LEGACY_CHECKED = True
 
 
 def get_pending_approvals() -> list[dict]:
-    """Return list of pending approval requests from task webhook callbacks."""
-    return _read_store()
+    """Return list of pending approval requests from task webhook callbacks, oldest first.
+
+    The approvals are copies, so callers may mutate them without touching the cache.
+    """
+    pending = sorted(_read_store().values(), key=lambda a: a.get("received_at_ns", 0))
+    return copy.deepcopy(pending)
 
 
 def remove_approval(execution_id: str, task_id: str) -> None:
     """Remove a handled approval from the store."""
-    data = [a for a in _read_store() if not (a.get("execution_id") == execution_id and a.get("task_id") == task_id)]
-    _write_store(data)
+    _migrate_legacy_store()
+    shard = _shard_path(execution_id)
+    with _store_lock(shard):
+        _write_store(shard, {"execution_id": execution_id, "task_id": task_id, "deleted": True})
+        _compact_store(shard)
 
 
 def _is_review_task(body: dict) -> bool:
     """True if this task webhook looks like a review step (e.g. request_review)."""
     name = body.get("name") or body.get("task_id") or ""
-    return bool(_REVIEW_TASK_PATTERN.search(str(name)))
+    if not isinstance(name, str):
+        name = str(name)
+    # Task names that indicate a review step (Support flow: request_review)
+    return "review" in name.lower()
 
 
 def _extract_from_task_payload(body: dict) -> dict | None:
@@ -65,71 +346,149 @@ def _extract_from_task_payload(body: dict) -> dict | None:
     execution_id = body.get("kickoff_id") or body.get("execution_id")
     task_id = body.get("name") or body.get("task_id") or "request_review"
     content = body.get("output") or body.get("summary")
-    if isinstance(content, dict):
-        content = json.dumps(content, indent=2)
+    if isinstance(content, (dict, list)):
+        content = _dumps(content, indent=_PRETTY_CONTENT).decode("utf-8")
     if not content:
         content = "(No output in task webhook)"
     if not execution_id:
         return None
     return {
-        "execution_id": execution_id,
+        "execution_id": str(execution_id),
         "task_id": str(task_id),
         "content": content,
         "raw": body,
+        "received_at_ns": time.time_ns(),
     }
 
 
-def _run_server(port: int) -> None:
-    """Run Flask server in this thread."""
-    from flask import Flask, request
+def _create_app():
+    """Build the Flask app that receives AMP webhook callbacks."""
+    from flask import Flask, Response, jsonify, request
 
     app = Flask(__name__)
 
+    def _json(body: bytes, status: int = 200) -> Response:
+        return Response(body, status=status, mimetype="application/json")
+
     @app.route("/task", methods=["POST"])
     def task():
         """Receives taskWebhookUrl callbacks from CrewAI AMP (fires on every task completion)."""
         try:
-            body = request.get_json(force=True, silent=True) or {}
+            try:
+                body = _loads(request.get_data(cache=False) or b"{}") or {}
+            except ValueError:
+                return _json(_INVALID_JSON, 400)
+            if not isinstance(body, dict):
+                return _json(_INVALID_JSON, 400)
             # Only store tasks that look like review steps (e.g. request_review)
             if not _is_review_task(body):
-                return {"ok": True, "message": "Task received (not a review task, ignored)"}, 200
+                return _json(_NOT_REVIEW)
             extracted = _extract_from_task_payload(body)
             if extracted:
-                data = _read_store()
-                data = [a for a in data if not (a.get("execution_id") == extracted["execution_id"] and a.get("task_id") == extracted["task_id"])]
-                data.append(extracted)
-                _write_store(data)
-                return {"ok": True, "message": "Review task stored for approval"}, 200
-            return {"ok": False, "message": "Missing kickoff_id"}, 400
+                _migrate_legacy_store()
+                # Later lines for the same (execution_id, task_id) supersede earlier ones
+                shard = _shard_path(extracted["execution_id"])
+                with _store_lock(shard):
+                    _write_store(shard, extracted)
+                return _json(_STORED)
+            return _json(_MISSING_KICKOFF, 400)
         except Exception as e:
-            return {"ok": False, "message": str(e)}, 500
+            return jsonify({"ok": False, "message": str(e)}), 500
 
     @app.route("/step", methods=["POST"])
     def step():
         """Receives stepWebhookUrl callbacks. Acknowledge but do not store."""
-        return {"ok": True}, 200
+        return _json(_OK)
 
     @app.route("/crew", methods=["POST"])
     def crew():
         """Receives crewWebhookUrl callbacks. Acknowledge but do not store."""
-        return {"ok": True}, 200
+        return _json(_OK)
 
     @app.route("/health", methods=["GET"])
     def health():
-        return {"status": "ok"}, 200
+        return _json(_HEALTH)
 
-    app.run(host="0.0.0.0", port=port, use_reloader=False, threaded=True)
+    return app
+
+
+def _run_server(port: int, ready=None) -> None:
+    """Run the Flask app in this process, under waitress when it is installed.
+
+    If ready (a multiprocessing Connection) is given, True is sent on it once the
+    port is bound, so the parent can tell a started server from a failed bind.
+    """
+    app = _create_app()
+    try:
+        from waitress import create_server
+    except ImportError:
+        from werkzeug.serving import make_server
+
+        server = make_server("0.0.0.0", port, app, threaded=True)
+        serve_forever = server.serve_forever
+    else:
+        server = create_server(app, host="0.0.0.0", port=port, threads=8, connection_limit=256)
+        serve_forever = server.run
+    if ready is not None:
+        ready.send(True)
+        ready.close()
+    serve_forever()
+
+
+def _watch_parent() -> None:
+    """Exit the server child as soon as its parent goes away, however it died."""
+    parent = multiprocessing.parent_process()
+    if parent is None:
+        return
+    # Waits on the parent sentinel: a pipe (POSIX) or process handle (Windows)
+    parent.join()
+    os._exit(0)
+
+
+def _serve_child(port: int, ready) -> None:
+    """Entry point of the webhook server child process."""
+    threading.Thread(target=_watch_parent, daemon=True).start()
+    _run_server(port, ready)
+
+
+def _stop_webhook_server() -> None:
+    """Terminate the webhook server child, if any (registered with atexit)."""
+    if _SERVER_PROCESS is not None and _SERVER_PROCESS.is_alive():
+        _SERVER_PROCESS.terminate()
+        _SERVER_PROCESS.join(timeout=5)
+
+
+atexit.register(_stop_webhook_server)
 
 
 def start_webhook_server(port: int | None = None) -> bool:
-    """Start the HITL webhook server in a background daemon thread. Returns True if started."""
-    global _SERVER_THREAD
-    if _SERVER_THREAD is not None and _SERVER_THREAD.is_alive():
+    """Start the HITL webhook server in a background child process.
+
+    Returns True once the child is serving on the port, False if it failed to start.
+    The child is spawned, so it re-imports the caller's main module: scripts that call
+    this at import time must do so under `if __name__ == "__main__":`.
+    """
+    global _SERVER_PROCESS
+    if _SERVER_PROCESS is not None and _SERVER_PROCESS.is_alive():
         return True
     port = port or int(os.getenv("HITL_WEBHOOK_PORT", "5050"))
     try:
-        _SERVER_THREAD = threading.Thread(target=_run_server, args=(port,), daemon=True)
-        _SERVER_THREAD.start()
+        ready_recv, ready_send = _MP_CONTEXT.Pipe(duplex=False)
+        process = _MP_CONTEXT.Process(target=_serve_child, args=(port, ready_send), daemon=True)
+        process.start()
+        ready_send.close()
+        try:
+            # EOF (child died, e.g. port already in use) also ends the poll
+            started = ready_recv.poll(_SERVER_STARTUP_TIMEOUT) and ready_recv.recv()
+        except EOFError:
+            started = False
+        finally:
+            ready_recv.close()
+        if not started:
+            process.terminate()
+            process.join(timeout=5)
+            return False
+        _SERVER_PROCESS = process
         return True
     except Exception:
         return False
@@ -5,18 +5,14 @@ Uses native CrewAI Gmail integration (requires CREWAI_PLATFORM_INTEGRATION_TOKEN
 and Gmail connected in AMP Integrations).
 """
 
-import re
+import string
 from email.utils import parseaddr
 
-from crewai import Task, Crew
 from pydantic import BaseModel
 
 from crewai.flow import Flow, listen, router, start
 from crewai.flow.human_feedback import human_feedback
 
-from supporttickets.agents.gmail_agent import get_gmail_agent
-from supporttickets.crews.support_crew.support_crew import SupportCrew
-
 
 class SupportState(BaseModel):
     """State for the support email flow."""
@@ -28,13 +24,35 @@ class SupportState(BaseModel):
     email_content: str = ""
 
 
-def _extract_sender_from_raw(raw: str) -> str:
-    """Extract email address from FROM line."""
-    match = re.search(r"FROM:\s*(.+)", raw, re.IGNORECASE)
-    if not match:
-        return ""
-    _, addr = parseaddr(match.group(1).strip())
-    return addr or match.group(1).strip()
+# ASCII-only upper-casing keeps indices aligned with the original line
+_ASCII_UPPER = str.maketrans(string.ascii_lowercase, string.ascii_uppercase)
+# Markdown decoration LLMs put around header values, e.g. "**SUBJECT:** Help"
+_HEADER_STRIP = " \t*_`"
+
+
+def _extract_headers_from_raw(raw: str) -> tuple[str, str]:
+    """Extract (subject, sender address) from SUBJECT/FROM lines in one pass.
+
+    Markers are matched case-insensitively anywhere in a line, so bulleted or
+    bold headers from the model ("- From: ...", "**SUBJECT:** ...") still parse.
+    """
+    subject = sender = ""
+    for line in raw.splitlines():
+        upper = line.translate(_ASCII_UPPER)
+        if not subject:
+            pos = upper.find("SUBJECT:")
+            if pos != -1:
+                subject = line[pos + 8 :].strip(_HEADER_STRIP)
+                continue
+        if not sender:
+            pos = upper.find("FROM:")
+            if pos != -1:
+                value = line[pos + 5 :].strip(_HEADER_STRIP)
+                _, addr = parseaddr(value)
+                sender = addr or value
+        if subject and sender:
+            break
+    return subject, sender
 
 
 class SupportEmailFlow(Flow[SupportState]):
@@ -43,6 +61,10 @@ class SupportEmailFlow(Flow[SupportState]):
     @start()
     def fetch_email(self, crewai_trigger_payload: dict | None = None):
         """Fetch the first support email from inbox using native Gmail integration."""
+        from crewai import Crew, Task
+
+        from supporttickets.agents.gmail_agent import get_gmail_agent
+
         agent = get_gmail_agent()
         task = Task(
             description=(
@@ -66,10 +88,9 @@ class SupportEmailFlow(Flow[SupportState]):
 
         self.state.email_raw = raw
         self.state.email_content = raw
-        self.state.original_sender = _extract_sender_from_raw(raw)
-
-        match = re.search(r"SUBJECT:\s*(.+)", raw, re.IGNORECASE)
-        self.state.email_subject = match.group(1).strip() if match else "Re: Support"
+        subject, sender = _extract_headers_from_raw(raw)
+        self.state.original_sender = sender
+        self.state.email_subject = subject or "Re: Support"
 
         return raw
 
@@ -79,6 +100,8 @@ class SupportEmailFlow(Flow[SupportState]):
         if not self.state.email_content:
             return "No support email to process."
 
+        from supporttickets.crews.support_crew.support_crew import SupportCrew
+
         result = (
             SupportCrew()
             .crew()
@@ -110,6 +133,10 @@ class SupportEmailFlow(Flow[SupportState]):
         if not self.state.original_sender or not self.state.draft:
             return "Cannot send: missing sender or draft."
 
+        from crewai import Crew, Task
+
+        from supporttickets.agents.gmail_agent import get_gmail_agent
+
         agent = get_gmail_agent()
         subject = f"Re: {self.state.email_subject}"
         task = Task(
@@ -0,0 +1,276 @@
+import json
+import time
+
+import pytest
+
+import hitl_webhook
+
+
+@pytest.fixture(autouse=True)
+def store_dir(tmp_path, monkeypatch):
+    store = tmp_path / "pending_hitl_approvals"
+    monkeypatch.setattr(hitl_webhook, "_HITL_DIR", store)
+    monkeypatch.setattr(hitl_webhook, "_LEGACY_CHECKED", False)
+    monkeypatch.delenv("HITL_STORE_PATH", raising=False)
+    monkeypatch.delenv("HITL_STORE_DIR", raising=False)
+    hitl_webhook._CACHE.clear()
+    yield store
+    hitl_webhook._CACHE.clear()
+
+
+def _store(execution_id, task_id="request_review", content="draft"):
+    record = {
+        "execution_id": execution_id,
+        "task_id": task_id,
+        "content": content,
+        "received_at_ns": time.time_ns(),
+    }
+    shard = hitl_webhook._shard_path(execution_id)
+    with hitl_webhook._store_lock(shard):
+        hitl_webhook._write_store(shard, record)
+    return shard
+
+
+def _line_count(shard):
+    return len(shard.read_bytes().splitlines())
+
+
+def test_empty_store():
+    assert hitl_webhook.get_pending_approvals() == []
+
+
+def test_upsert_replaces_earlier_record():
+    _store("exec-1", content="first")
+    _store("exec-1", content="second")
+    _store("exec-2")
+
+    pending = {a["execution_id"]: a["content"] for a in hitl_webhook.get_pending_approvals()}
+    assert pending == {"exec-1": "second", "exec-2": "draft"}
+
+
+def test_remove_approval_replays_tombstone():
+    _store("exec-1")
+    _store("exec-2")
+    _store("exec-3")
+
+    hitl_webhook.remove_approval("exec-2", "request_review")
+
+    hitl_webhook._CACHE.clear()
+    assert sorted(a["execution_id"] for a in hitl_webhook.get_pending_approvals()) == ["exec-1", "exec-3"]
+
+
+def test_torn_trailing_line_is_skipped():
+    shard = _store("exec-1")
+    with open(shard, "ab") as f:
+        f.write(b'{"execution_id":"exec-1","task_id":"request_review","con')
+
+    assert [a["content"] for a in hitl_webhook.get_pending_approvals()] == ["draft"]
+
+
+def test_compaction_drops_superseded_and_removed_lines():
+    for i in range(6):
+        shard = _store("exec-1", content=f"v{i}")
+    assert _line_count(shard) == 6
+
+    hitl_webhook.remove_approval("exec-1", "request_review")
+
+    assert shard.read_bytes() == b""
+    assert hitl_webhook.get_pending_approvals() == []
+
+
+def test_compaction_keeps_live_records():
+    _store("exec-1", content="old")
+    shard = _store("exec-1", content="new")
+    _store("exec-1", task_id="other")
+
+    hitl_webhook.remove_approval("exec-1", "other")
+
+    # 4 lines, 3 dead (superseded upsert, removed record, tombstone)
+    assert _line_count(shard) == 1
+    assert [a["content"] for a in hitl_webhook.get_pending_approvals()] == ["new"]
+
+
+def test_cache_invalidated_across_compaction():
+    _store("exec-1")
+    _store("exec-1", task_id="other")
+    assert len(hitl_webhook.get_pending_approvals()) == 2
+
+    hitl_webhook.remove_approval("exec-1", "other")
+    assert [a["task_id"] for a in hitl_webhook.get_pending_approvals()] == ["request_review"]
+
+    # Appends after the shard was replaced land in the new file
+    _store("exec-1", task_id="third")
+    assert sorted(a["task_id"] for a in hitl_webhook.get_pending_approvals()) == ["request_review", "third"]
+
+
+def test_cache_sees_writes_from_another_process(store_dir):
+    shard = _store("exec-1")
+    assert len(hitl_webhook.get_pending_approvals()) == 1
+
+    # Simulate another process appending directly to the shard
+    with open(shard, "ab") as f:
+        f.write(b'{"execution_id":"exec-1","task_id":"external","content":"x"}\n')
+
+    assert len(hitl_webhook.get_pending_approvals()) == 2
+
+
+def _store_many(store, prefix, count):
+    hitl_webhook._HITL_DIR = store
+    for i in range(count):
+        _store(f"{prefix}-{i}")
+
+
+def test_concurrent_writer_process_loses_nothing_during_compaction(store_dir):
+    import multiprocessing
+
+    ctx = multiprocessing.get_context("spawn")
+    writers = [ctx.Process(target=_store_many, args=(store_dir, f"w{n}", 100)) for n in range(2)]
+    for writer in writers:
+        writer.start()
+    # Meanwhile store and remove approvals so shards keep getting compacted
+    for i in range(100):
+        _store(f"tmp-{i}")
+        hitl_webhook.remove_approval(f"tmp-{i}", "request_review")
+    for writer in writers:
+        writer.join(timeout=60)
+        assert writer.exitcode == 0
+
+    hitl_webhook._CACHE.clear()
+    assert len(hitl_webhook.get_pending_approvals()) == 200
+
+
+def test_pending_approvals_are_copies():
+    shard = _store("exec-1")
+    with hitl_webhook._store_lock(shard):
+        hitl_webhook._write_store(
+            shard,
+            {
+                "execution_id": "exec-2",
+                "task_id": "request_review",
+                "raw": {"name": "request_review"},
+                "received_at_ns": time.time_ns(),
+            },
+        )
+
+    for approval in hitl_webhook.get_pending_approvals():
+        approval["content"] = "edited"
+        approval.setdefault("raw", {})["name"] = "edited"
+
+    assert [a.get("content") for a in hitl_webhook.get_pending_approvals()] == ["draft", None]
+    assert hitl_webhook.get_pending_approvals()[1]["raw"] == {"name": "request_review"}
+
+
+def test_pending_approvals_in_arrival_order():
+    ids = [f"exec-{i}" for i in range(20)]
+    for execution_id in ids:
+        _store(execution_id)
+
+    assert [a["execution_id"] for a in hitl_webhook.get_pending_approvals()] == ids
+
+
+@pytest.mark.parametrize(
+    "env, expected",
+    [
+        ({}, "pending_hitl_approvals"),
+        ({"HITL_STORE_PATH": "/data/approvals.json"}, "/data/approvals"),
+        ({"HITL_STORE_PATH": "/data/approvals"}, "/data/approvals.d"),
+        ({"HITL_STORE_PATH": "/data/approvals.json", "HITL_STORE_DIR": "/srv/hitl"}, "/srv/hitl"),
+    ],
+)
+def test_resolve_store_dir(monkeypatch, env, expected):
+    for key, value in env.items():
+        monkeypatch.setenv(key, value)
+
+    assert hitl_webhook._resolve_store_dir() == hitl_webhook.Path(expected)
+
+
+def test_migrates_legacy_json_store(store_dir):
+    legacy = store_dir.with_name(store_dir.name + ".json")
+    approvals = [
+        {"execution_id": "exec-1", "task_id": "request_review", "content": "a"},
+        {"execution_id": "exec-2", "task_id": "request_review", "content": "b"},
+    ]
+    legacy.write_text(json.dumps(approvals, indent=2))
+
+    assert [a["content"] for a in hitl_webhook.get_pending_approvals()] == ["a", "b"]
+    assert not legacy.exists()
+    assert legacy.with_name(legacy.name + ".migrated").exists()
+
+    hitl_webhook.remove_approval("exec-1", "request_review")
+    assert [a["content"] for a in hitl_webhook.get_pending_approvals()] == ["b"]
+
+
+def test_migrates_legacy_jsonl_from_store_path(store_dir, monkeypatch):
+    legacy = store_dir.parent / "custom.jsonl"
+    legacy.write_text(
+        '{"execution_id":"exec-1","task_id":"request_review","content":"a"}\n'
+        '{"execution_id":"exec-2","task_id":"request_review","content":"b"}\n'
+        '{"execution_id":"exec-1","task_id":"request_review","deleted":true}\n'
+    )
+    monkeypatch.setenv("HITL_STORE_PATH", str(legacy))
+
+    assert [a["content"] for a in hitl_webhook.get_pending_approvals()] == ["b"]
+    assert not legacy.exists()
+
+
+@pytest.fixture
+def client():
+    pytest.importorskip("flask")
+    return hitl_webhook._create_app().test_client()
+
+
+@pytest.mark.parametrize("body", [b"{not json", b"[1,2]", b'"x"', b"3"])
+def test_task_rejects_non_object_body(client, body):
+    resp = client.post("/task", data=body)
+
+    assert resp.status_code == 400
+    assert resp.get_json() == {"ok": False, "message": "Invalid JSON body"}
+
+
+def test_task_stores_review_and_ignores_others(client):
+    ignored = client.post("/task", json={"name": "research_task", "kickoff_id": "exec-1"})
+    stored = client.post("/task", json={"name": "request_review", "kickoff_id": "exec-1", "output": "draft"})
+
+    assert ignored.status_code == 200
+    assert stored.status_code == 200
+    assert [a["content"] for a in hitl_webhook.get_pending_approvals()] == ["draft"]
+
+
+@pytest.fixture
+def server(monkeypatch):
+    pytest.importorskip("flask")
+    monkeypatch.setattr(hitl_webhook, "_SERVER_PROCESS", None)
+    yield
+    hitl_webhook._stop_webhook_server()
+
+
+def _free_port():
+    import socket
+
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def test_webhook_server_runs_in_child_process(server):
+    import urllib.request
+
+    port = _free_port()
+    assert hitl_webhook.start_webhook_server(port)
+    assert hitl_webhook.start_webhook_server(port)  # already running
+
+    with urllib.request.urlopen(f"http://127.0.0.1:{port}/health", timeout=5) as resp:
+        assert json.loads(resp.read()) == {"status": "ok"}
+
+    hitl_webhook._stop_webhook_server()
+    assert not hitl_webhook._SERVER_PROCESS.is_alive()
+
+
+def test_webhook_server_reports_bind_failure(server):
+    import socket
+
+    with socket.socket() as sock:
+        sock.bind(("0.0.0.0", 0))
+        sock.listen()
+        assert not hitl_webhook.start_webhook_server(sock.getsockname()[1])
+    assert hitl_webhook._SERVER_PROCESS is None
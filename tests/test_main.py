@@ -0,0 +1,32 @@
+import pytest
+
+pytest.importorskip("crewai")
+
+from supporttickets.main import _extract_headers_from_raw  # noqa: E402
+
+
+@pytest.mark.parametrize(
+    "raw, expected",
+    [
+        ("SUBJECT: Help\nFROM: Jane <jane@x.com>\nBODY:\nhi", ("Help", "jane@x.com")),
+        ("subject: Help\nfrom: jane@x.com", ("Help", "jane@x.com")),
+        ("**SUBJECT:** Help\n**FROM:** Jane <jane@x.com>", ("Help", "jane@x.com")),
+        ("- Subject: Help\n- From: jane@x.com", ("Help", "jane@x.com")),
+        ("Here is the email:\n\n  SUBJECT: Help\n  FROM: <jane@x.com>", ("Help", "jane@x.com")),
+        ("BODY:\nno headers here", ("", "")),
+    ],
+)
+def test_extract_headers_from_raw(raw, expected):
+    assert _extract_headers_from_raw(raw) == expected
+
+
+def test_extract_headers_uses_first_occurrence():
+    raw = "SUBJECT: Support request\nFROM: jane@x.com\nBODY:\nForwarded from: bob@y.com"
+
+    assert _extract_headers_from_raw(raw) == ("Support request", "jane@x.com")
+
+
+def test_subject_line_is_not_read_as_sender():
+    raw = "SUBJECT: Message from: bob@y.com\nFROM: jane@x.com"
+
+    assert _extract_headers_from_raw(raw) == ("Message from: bob@y.com", "jane@x.com")